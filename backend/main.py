@@ -1,9 +1,21 @@
-from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi import FastAPI, UploadFile, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from collections import Counter, OrderedDict
+from typing import Optional
 import pdfplumber
 from io import BytesIO
+import anyio
+import asyncio
+import html
 import uvicorn
 import os
+import secrets
+import sys
+import threading
+import time
+import uuid
 
 app = FastAPI(title="PDF Text Extractor API", version="1.0.0")
 
@@ -22,6 +34,211 @@ app.add_middleware(
 
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 
+# Per-request profiling is only available when an admin token is configured
+PROFILE_ADMIN_TOKEN = os.environ.get("PROFILE_ADMIN_TOKEN")
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))  # seconds
+MAX_STORED_PROFILES = int(os.environ.get("MAX_STORED_PROFILES", "20"))
+
+profiles = OrderedDict()
+
+# Extraction deadline in seconds; clients give up after 300s, so stop a little before that
+EXTRACTION_TIMEOUT = float(os.environ.get("EXTRACTION_TIMEOUT", "280"))
+MAX_EXTRACTION_TIMEOUT = float(os.environ.get("MAX_EXTRACTION_TIMEOUT", "600"))
+DISCONNECT_POLL_INTERVAL = 0.5  # seconds between client disconnect checks while pages are extracted
+# Extractions running at once; each holds a whole upload in memory, so keep this low on small instances
+EXTRACTION_CONCURRENCY = int(os.environ.get("EXTRACTION_CONCURRENCY", "1"))
+
+extraction_limiter = None
+
+extraction_metrics = Counter(completed=0, partial=0, timed_out=0, cancelled=0)
+
+
+class StackSampler:
+    """Samples the call stack of one thread and aggregates it as collapsed stacks"""
+
+    def __init__(self, interval):
+        self.thread_id = None
+        self.interval = interval
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self, thread_id):
+        self.thread_id = thread_id
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            with self._lock:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self):
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def check_profile_token(token):
+    if not PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled")
+    if not token or not secrets.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+def store_profile(profile):
+    profiles[profile["id"]] = profile
+    while len(profiles) > MAX_STORED_PROFILES:
+        profiles.popitem(last=False)
+
+
+def render_flame_graph(profile):
+    """Render collapsed stacks as a static HTML flame graph (root at the top)"""
+    tree = {"children": {}, "count": 0}
+    for line in profile["collapsed"].splitlines():
+        stack, _, count = line.rpartition(" ")
+        node = tree
+        node["count"] += int(count)
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"children": {}, "count": 0})
+            node["count"] += int(count)
+
+    def render(name, node, total):
+        width = 100.0 * node["count"] / total if total else 0
+        children = "".join(
+            render(child_name, child, node["count"])
+            for child_name, child in sorted(node["children"].items(), key=lambda item: -item[1]["count"])
+        )
+        return (
+            f'<div class="frame" style="width:{width:.3f}%">'
+            f'<div class="label" title="{html.escape(name)} ({node["count"]} samples)">{html.escape(name)}</div>'
+            f'<div class="children">{children}</div></div>'
+        )
+
+    rows = "".join(
+        f"<tr><td>{page['page']}</td><td>{page['seconds'] * 1000:.1f}</td><td>{page['characters']}</td>"
+        f"<td>{html.escape(page.get('error', ''))}</td></tr>"
+        for page in profile["pages"]
+    )
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Profile {profile['id']}</title>
+<style>
+body {{ font-family: sans-serif; }}
+.frame {{ display: inline-block; vertical-align: top; box-sizing: border-box; }}
+.label {{ background: #f59e0b; border: 1px solid #fff; font: 11px monospace; overflow: hidden; white-space: nowrap; padding: 1px 2px; }}
+.children {{ display: flex; }}
+</style></head><body>
+<h2>{html.escape(profile['filename'])} &mdash; {profile['outcome']} ({profile['status_code']}), {profile['total_seconds']:.3f}s, {profile['samples']} samples</h2>
+<div class="children">{render("all", tree, tree["count"])}</div>
+<h3>Per-page timings</h3>
+<table><tr><th>Page</th><th>ms</th><th>Characters</th><th>Error</th></tr>{rows}</table>
+</body></html>"""
+
+
+def extract_timed(page, page_number, page_timings):
+    """Extract one page's text, recording its timing even when extraction fails"""
+    timing = {"page": page_number, "seconds": 0.0, "characters": 0}
+    page_started = time.perf_counter()
+    try:
+        page_text = page.extract_text()
+        timing["characters"] = len(page_text or "")
+        return page_text
+    except Exception as e:
+        timing["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        timing["seconds"] = time.perf_counter() - page_started
+        page_timings.append(timing)
+
+
+def extract_pages(contents, deadline, cancelled, sampler=None, page_timings=None):
+    """Extract page texts, stopping between pages once cancelled or past the deadline
+
+    Runs in a worker thread so the event loop stays free; a sampler, if given,
+    profiles this thread only. Returns the page texts, the number of pages
+    completed, the total page count and whether the deadline was hit.
+    """
+    if sampler:
+        sampler.start(threading.get_ident())
+    try:
+        with pdfplumber.open(BytesIO(contents)) as pdf:
+            if not pdf.pages:
+                raise HTTPException(status_code=400, detail="PDF has no pages")
+
+            extracted_pages = []
+            pages_completed = 0
+            timed_out = False
+            for i, page in enumerate(pdf.pages):
+                if cancelled.is_set():
+                    break
+                if time.monotonic() > deadline:
+                    timed_out = True
+                    break
+                if page_timings is None:
+                    page_text = page.extract_text()
+                else:
+                    page_text = extract_timed(page, i + 1, page_timings)
+                if page_text:
+                    extracted_pages.append(f"--- Page {i+1} ---\n{page_text}")
+                pages_completed += 1
+
+            return extracted_pages, pages_completed, len(pdf.pages), timed_out
+    finally:
+        if sampler:
+            sampler.stop()
+
+
+def get_extraction_limiter():
+    # Created lazily because anyio needs a running event loop to build the limiter
+    global extraction_limiter
+    if extraction_limiter is None:
+        extraction_limiter = anyio.CapacityLimiter(EXTRACTION_CONCURRENCY)
+    return extraction_limiter
+
+
+async def run_until_disconnected(request, cancelled, deadline, func, *args):
+    """Run func in a worker thread once an extraction slot is free, setting cancelled as soon as the client disconnects
+
+    Returns None without running func if the client disconnects or the deadline
+    passes while the request is still waiting for a slot.
+    """
+    limiter = get_extraction_limiter()
+    while True:
+        with anyio.move_on_after(DISCONNECT_POLL_INTERVAL):
+            await limiter.acquire()
+            break
+        if await request.is_disconnected():
+            cancelled.set()
+            return None
+        if time.monotonic() > deadline:
+            return None
+
+    task = asyncio.ensure_future(run_in_threadpool(func, *args))
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if not task.done() and not cancelled.is_set() and await request.is_disconnected():
+                cancelled.set()
+        return task.result()
+    except BaseException:
+        cancelled.set()
+        raise
+    finally:
+        limiter.release()
+
+
 @app.get("/")
 async def root():
     return {"message": "PDF Text Extractor API is running"}
@@ -30,6 +247,10 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    return dict(extraction_metrics)
+
 @app.post("/test-upload")
 async def test_upload(file: UploadFile):
     """Test endpoint to debug file uploads"""
@@ -40,10 +261,42 @@ async def test_upload(file: UploadFile):
         "headers": dict(file.headers) if hasattr(file, 'headers') else {}
     }
 
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "html", x_profile_token: Optional[str] = Header(None)):
+    """Return a stored extraction profile as an HTML flame graph, collapsed stacks or JSON"""
+    check_profile_token(x_profile_token)
+
+    profile = profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    if format == "html":
+        return HTMLResponse(render_flame_graph(profile))
+    if format == "collapsed":
+        return PlainTextResponse(profile["collapsed"])
+    if format == "json":
+        return profile
+    raise HTTPException(status_code=400, detail="Unsupported format. Use html, collapsed or json")
+
 @app.post("/extract-pdf")
-async def extract_pdf(file: UploadFile):
+async def extract_pdf(
+    request: Request,
+    file: UploadFile,
+    timeout: Optional[float] = None,
+    profile: bool = False,
+    x_profile_token: Optional[str] = Header(None),
+):
     """Extract text from uploaded PDF file"""
     
+    if timeout is None:
+        timeout = EXTRACTION_TIMEOUT
+    if not 0 < timeout <= MAX_EXTRACTION_TIMEOUT:
+        raise HTTPException(status_code=400, detail=f"timeout must be greater than 0 and at most {MAX_EXTRACTION_TIMEOUT:g} seconds")
+    deadline = time.monotonic() + timeout
+
+    if profile:
+        check_profile_token(x_profile_token)
+
     if not file:
         raise HTTPException(status_code=400, detail="No file provided")
     
@@ -66,37 +319,89 @@ async def extract_pdf(file: UploadFile):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail=f"Only PDF files are allowed. Received: {file.filename}")
 
+    sampler = None
+    profile_id = None
+    page_timings = None
+    cancelled = threading.Event()
+    status_code = 500
+    outcome = "error"
+    if profile:
+        sampler = StackSampler(PROFILE_SAMPLE_INTERVAL)
+        profile_id = uuid.uuid4().hex
+        started = time.perf_counter()
+        page_timings = []
+
     try:
         contents = await file.read()
         
         if not contents:
             raise HTTPException(status_code=400, detail="File content is empty")
         
-        with pdfplumber.open(BytesIO(contents)) as pdf:
-            if not pdf.pages:
-                raise HTTPException(status_code=400, detail="PDF has no pages")
-                
-            extracted_pages = []
-            for i, page in enumerate(pdf.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    extracted_pages.append(f"--- Page {i+1} ---\n{page_text}")
-            
-            text = "\n\n".join(extracted_pages)
+        extraction = await run_until_disconnected(
+            request, cancelled, deadline, extract_pages, contents, deadline, cancelled, sampler, page_timings
+        )
+
+        if cancelled.is_set():
+            outcome = "cancelled"
+            extraction_metrics["cancelled"] += 1
+            raise HTTPException(status_code=499, detail="Client closed request")
+
+        extracted_pages, pages_completed, total_pages, timed_out = extraction or ([], 0, 0, True)
+        text = "\n\n".join(extracted_pages)
         
+        if timed_out and pages_completed == 0:
+            outcome = "timed_out"
+            extraction_metrics["timed_out"] += 1
+            raise HTTPException(status_code=504, detail=f"Extraction timed out after {timeout:g} seconds")
+
         if not text.strip():
-            return {"extracted_text": "No text found in the PDF", "pages_processed": len(pdf.pages)}
-        
-        return {
-            "extracted_text": text.strip(),
-            "pages_processed": len(pdf.pages),
-            "characters_extracted": len(text.strip())
-        }
-        
-    except HTTPException:
+            result = {"extracted_text": "No text found in the PDF", "pages_processed": pages_completed}
+        else:
+            result = {
+                "extracted_text": text.strip(),
+                "pages_processed": pages_completed,
+                "characters_extracted": len(text.strip())
+            }
+
+        if timed_out:
+            outcome = "partial"
+            extraction_metrics["partial"] += 1
+            result["partial"] = True
+            result["total_pages"] = total_pages
+        else:
+            outcome = "completed"
+            extraction_metrics["completed"] += 1
+
+        status_code = 200
+        if profile_id:
+            result["profile_id"] = profile_id
+        return result
+
+    except HTTPException as e:
+        status_code = e.status_code
+        if profile_id:
+            e.headers = {**(e.headers or {}), "X-Profile-Id": profile_id}
         raise  
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing PDF: {str(e)}",
+            headers={"X-Profile-Id": profile_id} if profile_id else None,
+        )
+    finally:
+        if sampler:
+            sampler.stop()
+            store_profile({
+                "id": profile_id,
+                "filename": file.filename,
+                "status_code": status_code,
+                "outcome": outcome,
+                "total_seconds": time.perf_counter() - started,
+                "samples": sum(sampler.stacks.values()),
+                "sample_interval": PROFILE_SAMPLE_INTERVAL,
+                "pages": page_timings,
+                "collapsed": sampler.collapsed(),
+            })
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
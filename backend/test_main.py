@@ -0,0 +1,291 @@
+import time
+
+import anyio
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+TOKEN = "secret"
+
+
+class StubPage:
+    def __init__(self, text, delay=0.0, error=None):
+        self.text = text
+        self.delay = delay
+        self.error = error
+        self.extracted = False
+
+    def extract_text(self):
+        self.extracted = True
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.text
+
+
+class BusyLimiter:
+    """Stands in for a limiter whose only slot is held by another request"""
+
+    async def acquire(self):
+        await anyio.sleep_forever()
+
+    def release(self):
+        raise AssertionError("a slot that was never acquired must not be released")
+
+
+class StubPDF:
+    def __init__(self, pages, open_delay=0.0):
+        self.pages = pages
+        time.sleep(open_delay)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+@pytest.fixture
+def use_pages(monkeypatch):
+    def use(pages, open_delay=0.0):
+        monkeypatch.setattr(main.pdfplumber, "open", lambda stream: StubPDF(pages, open_delay))
+    return use
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "PROFILE_ADMIN_TOKEN", TOKEN)
+    monkeypatch.setattr(main, "PROFILE_SAMPLE_INTERVAL", 0.001)
+    monkeypatch.setattr(main, "profiles", main.OrderedDict())
+    monkeypatch.setattr(main, "extraction_limiter", None)
+    monkeypatch.setattr(main, "extraction_metrics", main.Counter(completed=0, partial=0, timed_out=0, cancelled=0))
+    return TestClient(main.app)
+
+
+def upload(client, query="", headers=None):
+    return client.post(
+        f"/extract-pdf{query}",
+        files={"file": ("sample.pdf", b"%PDF-1.4", "application/pdf")},
+        headers=headers,
+    )
+
+
+def test_profiling_disabled_without_admin_token(client, monkeypatch):
+    monkeypatch.setattr(main, "PROFILE_ADMIN_TOKEN", None)
+
+    response = upload(client, "?profile=true", {"X-Profile-Token": TOKEN})
+
+    assert response.status_code == 404
+    assert client.get("/profiles/abc", headers={"X-Profile-Token": TOKEN}).status_code == 404
+
+
+def test_profiling_rejects_wrong_token(client, use_pages):
+    use_pages([StubPage("hello")])
+
+    assert upload(client, "?profile=true", {"X-Profile-Token": "wrong"}).status_code == 403
+    assert upload(client, "?profile=true").status_code == 403
+    assert client.get("/profiles/abc", headers={"X-Profile-Token": "wrong"}).status_code == 403
+
+    non_ascii = {"X-Profile-Token": "café".encode("latin-1")}
+    assert upload(client, "?profile=true", non_ascii).status_code == 403
+    assert client.get("/profiles/abc", headers=non_ascii).status_code == 403
+
+
+def test_unprofiled_request_has_no_profile_id(client, use_pages):
+    use_pages([StubPage("hello")])
+
+    response = upload(client)
+
+    assert response.status_code == 200
+    assert "profile_id" not in response.json()
+    assert not main.profiles
+
+
+def test_profiled_request_stores_page_timings(client, use_pages):
+    use_pages([StubPage("first", delay=0.02), StubPage("second", delay=0.02)])
+
+    response = upload(client, "?profile=true", {"X-Profile-Token": TOKEN})
+
+    assert response.status_code == 200
+    profile_id = response.json()["profile_id"]
+    profile = client.get(f"/profiles/{profile_id}?format=json", headers={"X-Profile-Token": TOKEN}).json()
+    assert profile["outcome"] == "completed"
+    assert profile["status_code"] == 200
+    assert [page["page"] for page in profile["pages"]] == [1, 2]
+    assert [page["characters"] for page in profile["pages"]] == [5, 6]
+    assert "extract_pages (main.py)" in profile["collapsed"]
+
+    collapsed = client.get(f"/profiles/{profile_id}?format=collapsed", headers={"X-Profile-Token": TOKEN})
+    assert collapsed.text == profile["collapsed"]
+    flame_graph = client.get(f"/profiles/{profile_id}", headers={"X-Profile-Token": TOKEN})
+    assert flame_graph.headers["content-type"].startswith("text/html")
+
+
+def test_failed_request_keeps_profile(client, use_pages):
+    use_pages([StubPage("first"), StubPage(None, delay=0.01, error=ValueError("broken page"))])
+
+    response = upload(client, "?profile=true", {"X-Profile-Token": TOKEN})
+
+    assert response.status_code == 500
+    profile_id = response.headers["X-Profile-Id"]
+    profile = main.profiles[profile_id]
+    assert profile["outcome"] == "error"
+    assert profile["status_code"] == 500
+    assert [page["page"] for page in profile["pages"]] == [1, 2]
+    assert "error" not in profile["pages"][0]
+    assert profile["pages"][1]["error"] == "ValueError: broken page"
+    assert profile["pages"][1]["seconds"] >= 0.01
+    assert "ValueError: broken page" in main.render_flame_graph(profile)
+
+
+def test_stored_profiles_are_bounded(client, use_pages, monkeypatch):
+    monkeypatch.setattr(main, "MAX_STORED_PROFILES", 2)
+    use_pages([StubPage("hello")])
+
+    ids = [upload(client, "?profile=true", {"X-Profile-Token": TOKEN}).json()["profile_id"] for _ in range(3)]
+
+    assert list(main.profiles) == ids[1:]
+
+
+def test_collapsed_stacks_are_sorted_by_count():
+    sampler = main.StackSampler(0.001)
+    sampler.stacks.update({"a;b": 1, "a;c": 3})
+
+    assert sampler.collapsed() == "a;c 3\na;b 1"
+
+
+def test_flame_graph_handles_frame_names_with_spaces():
+    profile = {
+        "id": "abc",
+        "filename": "<sample>.pdf",
+        "status_code": 200,
+        "outcome": "completed",
+        "total_seconds": 0.5,
+        "samples": 4,
+        "pages": [{"page": 1, "seconds": 0.5, "characters": 10}],
+        "collapsed": "run (main.py);extract_text (page.py) 3\nrun (main.py) 1",
+    }
+
+    rendered = main.render_flame_graph(profile)
+
+    assert 'title="run (main.py) (4 samples)"' in rendered
+    assert 'title="extract_text (page.py) (3 samples)"' in rendered
+    assert 'style="width:75.000%"' in rendered
+    assert "&lt;sample&gt;.pdf" in rendered
+
+
+@pytest.mark.parametrize("timeout", ["0", "-1", "601"])
+def test_timeout_out_of_range_is_rejected(client, use_pages, timeout):
+    use_pages([StubPage("hello")])
+
+    response = upload(client, f"?timeout={timeout}")
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "timeout must be greater than 0 and at most 600 seconds"
+
+
+def test_completed_extraction_is_counted(client, use_pages):
+    use_pages([StubPage("first"), StubPage("second")])
+
+    response = upload(client, "?timeout=600")
+
+    assert response.status_code == 200
+    assert response.json()["pages_processed"] == 2
+    assert "partial" not in response.json()
+    assert client.get("/metrics").json() == {"completed": 1, "partial": 0, "timed_out": 0, "cancelled": 0}
+
+
+def test_deadline_returns_partial_result(client, use_pages):
+    pages = [StubPage("first", delay=0.1), StubPage("second"), StubPage("third")]
+    use_pages(pages)
+
+    response = upload(client, "?timeout=0.05")
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["partial"] is True
+    assert result["pages_processed"] == 1
+    assert result["total_pages"] == 3
+    assert result["extracted_text"] == "--- Page 1 ---\nfirst"
+    assert not pages[1].extracted
+    assert client.get("/metrics").json() == {"completed": 0, "partial": 1, "timed_out": 0, "cancelled": 0}
+
+
+def test_deadline_before_first_page_returns_504(client, use_pages):
+    use_pages([StubPage("first")], open_delay=0.1)
+
+    response = upload(client, "?timeout=0.05")
+
+    assert response.status_code == 504
+    assert response.json()["detail"] == "Extraction timed out after 0.05 seconds"
+    assert client.get("/metrics").json() == {"completed": 0, "partial": 0, "timed_out": 1, "cancelled": 0}
+
+
+def test_client_disconnect_cancels_extraction(client, use_pages, monkeypatch):
+    async def disconnected(request):
+        return True
+
+    monkeypatch.setattr(main.Request, "is_disconnected", disconnected)
+    monkeypatch.setattr(main, "DISCONNECT_POLL_INTERVAL", 0.01)
+    pages = [StubPage("page", delay=0.05) for _ in range(5)]
+    use_pages(pages)
+
+    response = upload(client)
+
+    assert response.status_code == 499
+    assert not pages[-1].extracted
+    assert client.get("/metrics").json() == {"completed": 0, "partial": 0, "timed_out": 0, "cancelled": 1}
+
+
+def test_cancelled_profile_records_outcome(client, use_pages, monkeypatch):
+    async def disconnected(request):
+        return True
+
+    monkeypatch.setattr(main.Request, "is_disconnected", disconnected)
+    monkeypatch.setattr(main, "DISCONNECT_POLL_INTERVAL", 0.01)
+    use_pages([StubPage("page", delay=0.05) for _ in range(5)])
+
+    response = upload(client, "?profile=true", {"X-Profile-Token": TOKEN})
+
+    assert response.status_code == 499
+    assert main.profiles[response.headers["X-Profile-Id"]]["outcome"] == "cancelled"
+
+
+def test_extraction_slot_is_released(client, use_pages):
+    use_pages([StubPage("first"), StubPage(None, error=ValueError("broken page"))])
+
+    assert upload(client).status_code == 500
+    use_pages([StubPage("first")])
+    assert upload(client).status_code == 200
+    assert main.extraction_limiter.borrowed_tokens == 0
+
+
+def test_deadline_while_queued_returns_504(client, use_pages, monkeypatch):
+    monkeypatch.setattr(main, "extraction_limiter", BusyLimiter())
+    monkeypatch.setattr(main, "DISCONNECT_POLL_INTERVAL", 0.01)
+    pages = [StubPage("first")]
+    use_pages(pages)
+
+    response = upload(client, "?timeout=0.05")
+
+    assert response.status_code == 504
+    assert not pages[0].extracted
+    assert client.get("/metrics").json() == {"completed": 0, "partial": 0, "timed_out": 1, "cancelled": 0}
+
+
+def test_disconnect_while_queued_cancels_extraction(client, use_pages, monkeypatch):
+    async def disconnected(request):
+        return True
+
+    monkeypatch.setattr(main.Request, "is_disconnected", disconnected)
+    monkeypatch.setattr(main, "extraction_limiter", BusyLimiter())
+    monkeypatch.setattr(main, "DISCONNECT_POLL_INTERVAL", 0.01)
+    pages = [StubPage("first")]
+    use_pages(pages)
+
+    response = upload(client)
+
+    assert response.status_code == 499
+    assert not pages[0].extracted
+    assert client.get("/metrics").json() == {"completed": 0, "partial": 0, "timed_out": 0, "cancelled": 1}
@@ -54,9 +54,14 @@ function App() {
 
     try {
       let text = '';
+      let warning = '';
 
       if (file.type === 'application/pdf') {
-        text = await extractPdfViaAPI(file);
+        const result = await extractPdfViaAPI(file);
+        text = result.extracted_text || '';
+        if (result.partial) {
+          warning = `⚠️ Partial result - Extraction timed out after ${result.pages_processed} of ${result.total_pages} pages.`;
+        }
       } else if (file.type === 'application/vnd.openxmlformats-officedocument.wordprocessingml.document') {
         text = await extractDocxText(file);
       } else if (file.type === 'text/plain') {
@@ -69,7 +74,11 @@ function App() {
 
       if (text && text.trim()) {
         setExtractedText(text);
-        setSuccess(`✅ Success! Extracted ${text.length.toLocaleString()} characters`);
+        if (warning) {
+          setError(warning);
+        } else {
+          setSuccess(`✅ Success! Extracted ${text.length.toLocaleString()} characters`);
+        }
       } else {
         setError('⚠️ No text content found in the uploaded file.');
       }
@@ -92,8 +101,7 @@ function App() {
       });
 
       if (response.status === 200) {
-        const result = await response.json();
-        return result.extracted_text || '';
+        return await response.json();
       } else if (response.status === 413) {
         throw new Error('File too large - Please use a smaller PDF file (max 100MB)');
       } else if (response.status === 400) {
@@ -101,6 +109,8 @@ function App() {
         throw new Error(`Invalid file: ${error.detail || 'Invalid PDF'}`);
       } else if (response.status === 500) {
         throw new Error('Server error - There was an issue processing your PDF. Please try again.');
+      } else if (response.status === 504) {
+        throw new Error('Processing timed out - The PDF is too complex to extract within the time limit.');
       } else {
         const error = await response.json();
         throw new Error(error.detail || 'API Error');
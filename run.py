@@ -335,7 +335,10 @@ def extract_pdf_via_api(uploaded_file):
 
         if response.status_code == 200:
             result = response.json()
-            st.success(f"✅ **Success!** Extracted {result.get('characters_extracted', 0):,} characters from {result.get('pages_processed', 0)} pages.")
+            if result.get("partial"):
+                st.warning(f"⚠️ **Partial result** - Extraction timed out after {result.get('pages_processed', 0)} of {result.get('total_pages', 0)} pages.")
+            else:
+                st.success(f"✅ **Success!** Extracted {result.get('characters_extracted', 0):,} characters from {result.get('pages_processed', 0)} pages.")
             return result.get("extracted_text", "")
             
         elif response.status_code == 413:
@@ -354,6 +357,10 @@ def extract_pdf_via_api(uploaded_file):
             st.error("❌ **Server error** - There was an issue processing your PDF. Please try again.")
             return None
             
+        elif response.status_code == 504:
+            st.error("🚫 **Processing timed out** - The PDF is too complex to extract within the time limit. Try a smaller file.")
+            return None
+            
         else:
             try:
                 error_detail = response.json().get("detail", "Unknown error")